@@ -4,8 +4,11 @@ Fixed Telegram Music Userbot Client
 """
 
 import asyncio
+import functools
 import os
+import re
 import logging
+import tempfile
 from typing import Dict, Any, Optional
 from pathlib import Path
 
@@ -18,6 +21,41 @@ from .music import MusicManager
 
 logger = logging.getLogger(__name__)
 
+# Telethon picks up cryptg automatically for C-accelerated MTProto encryption
+try:
+    import cryptg  # noqa: F401
+except ImportError:
+    logger.warning("cryptg not installed - MTProto encryption will use slow pure-Python AES")
+
+# Dot-commands understood by the userbot
+COMMANDS = (
+    'join', 'leave', 'play', 'stop', 'pause', 'resume',
+    'mute', 'unmute', 'replay', 'shazam', 'debug', 'status',
+)
+
+# Compiled once per process, shared by all clients
+_COMMAND_RE = re.compile(r'^\.(' + '|'.join(COMMANDS) + r')(?:\s+(?P<arg>.+))?$')
+
+
+def _reply_audio_mime(reply) -> Optional[str]:
+    """Return audio MIME type of replied message, or None if it isn't audio"""
+    mime_type = getattr(getattr(reply, 'file', None), 'mime_type', None) or ''
+    return mime_type if mime_type.startswith('audio/') else None
+
+
+def _simple_command(ok_msg: str, fail_msg: str):
+    """Wrap command returning success flag with standard replies"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, event, arg: Optional[str]):
+            try:
+                success = await func(self, event, arg)
+                await event.respond(ok_msg if success else fail_msg)
+            except Exception as e:
+                await event.respond(f"❌ Error: {e}")
+        return wrapper
+    return decorator
+
 
 class MusicUserbot:
     def __init__(self):
@@ -29,7 +67,6 @@ class MusicUserbot:
         # Paths
         self.data_dir = Path("data")
         self.session_file = self.data_dir / "userbot.session"
-        self.credentials_file = self.data_dir / "credentials.json"
         
         # Ensure data directory exists
         self.data_dir.mkdir(exist_ok=True)
@@ -38,17 +75,27 @@ class MusicUserbot:
         self.is_authenticated = False
         self.me = None
         self.pending_code_hash = None
+        
+        # Cached status template, see get_status()
+        self._status = {
+            "authenticated": False,
+            "connected": False,
+            "version": self.version,
+            "user": None
+        }
+        self._status_me = None
+        
+        # Commands - single handler dispatches by command name
+        self._commands = {name: getattr(self, f'_cmd_{name}') for name in COMMANDS}
+        self._handlers_client = None
 
     def has_saved_credentials(self) -> bool:
         """Check if we have saved API credentials"""
-        return self.credentials_file.exists()
+        return self.database.get_credentials() is not None
 
     async def auto_initialize(self) -> bool:
         """Auto-initialize with saved credentials"""
         try:
-            if not self.has_saved_credentials():
-                return False
-                
             credentials = self.database.get_credentials()
             if not credentials:
                 return False
@@ -58,12 +105,21 @@ class MusicUserbot:
             return True
             
         except Exception as e:
-            logger.error(f"❌ Auto-initialization failed: {e}")
+            logger.error("❌ Auto-initialization failed: %s", e)
             return False
 
     async def initialize(self, api_id: int, api_hash: str):
         """Initialize userbot with API credentials"""
         try:
+            # Keep existing client (and its live session) if credentials are unchanged
+            if self.client is not None:
+                if self.database.get_credentials() == {'api_id': api_id, 'api_hash': api_hash}:
+                    logger.info("✅ Userbot already initialized with these credentials")
+                    return
+                
+                # Credentials changed - release the old client before replacing it
+                await self.disconnect()
+            
             # Save credentials
             self.database.save_credentials(api_id, api_hash)
             
@@ -82,7 +138,7 @@ class MusicUserbot:
             logger.info("✅ Userbot initialized with API credentials")
             
         except Exception as e:
-            logger.error(f"❌ Failed to initialize userbot: {e}")
+            logger.error("❌ Failed to initialize userbot: %s", e)
             raise
 
     async def start(self, force_auth: bool = False) -> bool:
@@ -92,7 +148,7 @@ class MusicUserbot:
                 logger.error("❌ Client not initialized")
                 return False
             
-            await self.client.connect()
+            await self._ensure_connected()
             
             # Check if already authenticated
             if await self.client.is_user_authorized() and not force_auth:
@@ -105,33 +161,39 @@ class MusicUserbot:
                 # Set up event handlers
                 self._setup_handlers()
                 
-                logger.info(f"✅ Authenticated as {self.me.first_name} (@{self.me.username})")
+                logger.info("✅ Authenticated as %s (@%s)", self.me.first_name, self.me.username)
                 return True
             else:
                 logger.info("⏳ Authentication required")
                 return False
                 
         except Exception as e:
-            logger.error(f"❌ Failed to start userbot: {e}")
+            logger.error("❌ Failed to start userbot: %s", e)
             return False
 
+    async def _ensure_connected(self):
+        """Connect client unless already connected, reusing the live session"""
+        if not self.client:
+            raise RuntimeError("Client not initialized")
+        if not self.client.is_connected():
+            await self.client.connect()
+
     async def send_code(self, phone: str) -> dict:
         """Send verification code to phone"""
         try:
-            if not self.client or not self.client.is_connected():
-                await self.client.connect()
+            await self._ensure_connected()
             
             result = await self.client.send_code_request(phone)
             self.pending_code_hash = result.phone_code_hash
             
-            logger.info(f"📱 Verification code sent to {phone}")
+            logger.info("📱 Verification code sent to %s", phone)
             return {
                 'success': True,
                 'message': f'Verification code sent to {phone}'
             }
             
         except Exception as e:
-            logger.error(f"❌ Failed to send code: {e}")
+            logger.error("❌ Failed to send code: %s", e)
             return {
                 'success': False,
                 'error': str(e)
@@ -146,6 +208,8 @@ class MusicUserbot:
                     'error': 'No pending verification code'
                 }
             
+            await self._ensure_connected()
+            
             try:
                 await self.client.sign_in(code=code, phone_code_hash=self.pending_code_hash)
             except SessionPasswordNeededError:
@@ -167,7 +231,7 @@ class MusicUserbot:
             # Set up event handlers
             self._setup_handlers()
             
-            logger.info(f"✅ Successfully authenticated as {self.me.first_name}")
+            logger.info("✅ Successfully authenticated as %s", self.me.first_name)
             
             return {
                 'success': True,
@@ -182,201 +246,176 @@ class MusicUserbot:
             }
             
         except Exception as e:
-            logger.error(f"❌ Failed to verify code: {e}")
+            logger.error("❌ Failed to verify code: %s", e)
             return {
                 'success': False,
                 'error': str(e)
             }
 
     def _setup_handlers(self):
-        """Set up message handlers"""
+        """Set up message handlers (once per client)"""
+        if self._handlers_client is self.client:
+            return
         
-        @self.client.on(events.NewMessage(pattern=r'\.join'))
-        async def join_handler(event):
-            """Join voice chat"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.join_voice_chat(chat_id)
-                if success:
-                    await event.respond("✅ Joined voice chat!")
-                else:
-                    await event.respond("❌ Failed to join voice chat")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+        self.client.add_event_handler(
+            self._on_command,
+            events.NewMessage(outgoing=True, pattern=self._match_command)
+        )
+        self._handlers_client = self.client
 
-        @self.client.on(events.NewMessage(pattern=r'\.leave'))
-        async def leave_handler(event):
-            """Leave voice chat"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.leave_voice_chat(chat_id)
-                if success:
-                    await event.respond("✅ Left voice chat!")
-                else:
-                    await event.respond("❌ Failed to leave voice chat")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    async def _on_command(self, event):
+        """Dispatch dot-command to its handler"""
+        match = event.pattern_match
+        handler = self._commands[match.group(1)]
+        await handler(event, match.group('arg'))
 
-        @self.client.on(events.NewMessage(pattern=r'\.play (.+)'))
-        async def play_handler(event):
-            """Play music from URL or reply to audio"""
-            try:
-                source = event.pattern_match.group(1)
-                chat_id = event.chat_id
-                reply = await event.get_reply_message()
-                
-                # Check if user is joined to voice chat
-                if chat_id not in self.music.group_calls:
-                    await event.respond("❌ Not joined to voice chat. Use .join first")
-                    return
-                
-                await event.respond("🎵 Downloading...")
-                
-                # Play from file if replying to audio
-                if reply and reply.file and reply.file.mime_type and reply.file.mime_type.startswith('audio'):
-                    await event.edit("⬇️ Downloading audio file...")
-                    audio_file = await reply.download_media()
-                    await event.edit("🔄 Converting...")
-                    success = await self.music.play_from_file(chat_id, audio_file)
-                else:
-                    # Play from URL
-                    await event.edit("⬇️ Downloading from URL...")
-                    success = await self.music.play_audio(chat_id, source)
-                
-                if success:
-                    await event.edit("▶️ Playing...")
-                else:
-                    await event.edit("❌ Failed to play audio")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    def _match_command(self, text: str):
+        """Match command text, skipping the regex for non-dot messages"""
+        if not text.startswith('.'):
+            return None
+        return _COMMAND_RE.match(text)
 
-        @self.client.on(events.NewMessage(pattern=r'\.stop'))
-        async def stop_handler(event):
-            """Stop playback"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.stop_audio(chat_id)
-                if success:
-                    await event.respond("⏹️ Stopped playback")
-                else:
-                    await event.respond("❌ Failed to stop playback")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    @_simple_command("✅ Joined voice chat!", "❌ Failed to join voice chat")
+    async def _cmd_join(self, event, arg: Optional[str]) -> bool:
+        """Join voice chat"""
+        return await self.music.join_voice_chat(event.chat_id)
 
-        @self.client.on(events.NewMessage(pattern=r'\.pause'))
-        async def pause_handler(event):
-            """Pause playback"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.pause_audio(chat_id)
-                if success:
-                    await event.respond("⏸️ Paused playback")
-                else:
-                    await event.respond("❌ Failed to pause playback")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    @_simple_command("✅ Left voice chat!", "❌ Failed to leave voice chat")
+    async def _cmd_leave(self, event, arg: Optional[str]) -> bool:
+        """Leave voice chat"""
+        return await self.music.leave_voice_chat(event.chat_id)
 
-        @self.client.on(events.NewMessage(pattern=r'\.resume'))
-        async def resume_handler(event):
-            """Resume playback"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.resume_audio(chat_id)
-                if success:
-                    await event.respond("▶️ Resumed playback")
-                else:
-                    await event.respond("❌ Failed to resume playback")
-            except Exception as e:
+    async def _cmd_play(self, event, arg: Optional[str]):
+        """Play music from URL or reply to audio"""
+        status_msg = None
+        try:
+            source = arg
+            chat_id = event.chat_id
+            
+            # Check if user is joined to voice chat
+            session = self.music.group_calls.get(chat_id)
+            if session is None:
+                await event.respond("❌ Not joined to voice chat. Use .join first")
+                return
+            
+            # Only fetch the replied message when there is one
+            reply = await event.get_reply_message() if event.is_reply else None
+            is_audio_reply = _reply_audio_mime(reply) is not None
+            if not source and not is_audio_reply:
+                await event.respond("❌ Usage: .play <url> or reply to an audio file")
+                return
+            
+            # One progress message, edited once with the final result
+            status_msg = await event.respond("🎵 Processing...")
+            
+            # Play from file if replying to audio
+            if is_audio_reply:
+                audio_file = await reply.download_media()
+                success = await self.music.play_from_file(chat_id, audio_file, session)
+            else:
+                # Play from URL
+                success = await self.music.play_audio(chat_id, source, session)
+            
+            if success:
+                await status_msg.edit("▶️ Playing...")
+            else:
+                await status_msg.edit("❌ Failed to play audio")
+        except Exception as e:
+            # Replace the progress message rather than leaving it stale next to the error
+            if status_msg is not None:
+                await status_msg.edit(f"❌ Error: {e}")
+            else:
                 await event.respond(f"❌ Error: {e}")
 
-        @self.client.on(events.NewMessage(pattern=r'\.mute'))
-        async def mute_handler(event):
-            """Mute audio"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.mute_audio(chat_id)
-                if success:
-                    await event.respond("🔇 Muted!")
-                else:
-                    await event.respond("❌ Failed to mute")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    @_simple_command("⏹️ Stopped playback", "❌ Failed to stop playback")
+    async def _cmd_stop(self, event, arg: Optional[str]) -> bool:
+        """Stop playback"""
+        return await self.music.stop_audio(event.chat_id)
 
-        @self.client.on(events.NewMessage(pattern=r'\.unmute'))
-        async def unmute_handler(event):
-            """Unmute audio"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.unmute_audio(chat_id)
-                if success:
-                    await event.respond("🔊 Unmuted!")
-                else:
-                    await event.respond("❌ Failed to unmute")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    @_simple_command("⏸️ Paused playback", "❌ Failed to pause playback")
+    async def _cmd_pause(self, event, arg: Optional[str]) -> bool:
+        """Pause playback"""
+        return await self.music.pause_audio(event.chat_id)
 
-        @self.client.on(events.NewMessage(pattern=r'\.replay'))
-        async def replay_handler(event):
-            """Replay current audio"""
-            try:
-                chat_id = event.chat_id
-                success = await self.music.replay_audio(chat_id)
-                if success:
-                    await event.respond("🔄 Replaying...")
-                else:
-                    await event.respond("❌ Failed to replay")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    @_simple_command("▶️ Resumed playback", "❌ Failed to resume playback")
+    async def _cmd_resume(self, event, arg: Optional[str]) -> bool:
+        """Resume playback"""
+        return await self.music.resume_audio(event.chat_id)
+
+    @_simple_command("🔇 Muted!", "❌ Failed to mute")
+    async def _cmd_mute(self, event, arg: Optional[str]) -> bool:
+        """Mute audio"""
+        return await self.music.mute_audio(event.chat_id)
 
-        @self.client.on(events.NewMessage(pattern=r'\.shazam'))
-        async def shazam_handler(event):
-            """Recognize music from reply"""
+    @_simple_command("🔊 Unmuted!", "❌ Failed to unmute")
+    async def _cmd_unmute(self, event, arg: Optional[str]) -> bool:
+        """Unmute audio"""
+        return await self.music.unmute_audio(event.chat_id)
+
+    @_simple_command("🔄 Replaying...", "❌ Failed to replay")
+    async def _cmd_replay(self, event, arg: Optional[str]) -> bool:
+        """Replay current audio"""
+        return await self.music.replay_audio(event.chat_id)
+
+    async def _cmd_shazam(self, event, arg: Optional[str]):
+        """Recognize music from reply"""
+        try:
+            reply = await event.get_reply_message() if event.is_reply else None
+            if _reply_audio_mime(reply) is None:
+                await event.respond("❌ Reply to an audio file")
+                return
+            
+            await event.respond("⬇️ Downloading...")
+            # Stream to disk instead of buffering the whole file in memory
+            with tempfile.NamedTemporaryFile(
+                dir=self.music.downloads_dir, prefix='shazam-', suffix=reply.file.ext or '', delete=False
+            ) as tmp:
+                audio_file = tmp.name
             try:
-                reply = await event.get_reply_message()
-                if not reply or not reply.file or not reply.file.mime_type or not reply.file.mime_type.startswith('audio'):
-                    await event.respond("❌ Reply to an audio file")
-                    return
-                
-                await event.respond("⬇️ Downloading...")
-                audio_bytes = await reply.download_media(bytes)
+                await reply.download_media(file=audio_file)
                 
                 await event.edit("🎵 Recognizing...")
-                result = await self.music.shazam_recognize(audio_bytes)
+                result = await self.music.shazam_recognize_file(audio_file)
+            finally:
+                # Normally removed by shazam_recognize_file, but not if the download failed
+                if os.path.exists(audio_file):
+                    os.remove(audio_file)
+            
+            if result:
+                response = f"🎵 **Recognized track:**\n🎤 **{result['title']}**\n👤 **{result['artist']}**"
+                await event.edit(response)
+            else:
+                await event.edit("❌ Could not recognize track")
                 
-                if result:
-                    response = f"🎵 **Recognized track:**\n🎤 **{result['title']}**\n👤 **{result['artist']}**"
-                    await event.edit(response)
-                else:
-                    await event.edit("❌ Could not recognize track")
-                    
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+        except Exception as e:
+            await event.respond(f"❌ Error: {e}")
 
-        @self.client.on(events.NewMessage(pattern=r'\.debug'))
-        async def debug_handler(event):
-            """Debug info"""
-            try:
-                debug_info = self.music.debug_info()
-                await event.respond(f"🐛 {debug_info}")
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+    async def _cmd_debug(self, event, arg: Optional[str]):
+        """Debug info"""
+        try:
+            debug_info = self.music.debug_info()
+            await event.respond(f"🐛 {debug_info}")
+        except Exception as e:
+            await event.respond(f"❌ Error: {e}")
 
-        @self.client.on(events.NewMessage(pattern=r'\.status'))
-        async def status_handler(event):
-            """Get status"""
-            try:
-                chat_id = event.chat_id
-                status = self.music.get_status(chat_id)
-                
-                status_text = f"""
+    async def _cmd_status(self, event, arg: Optional[str]):
+        """Get status"""
+        try:
+            chat_id = event.chat_id
+            status = self.music.get_status(chat_id)
+            
+            status_text = f"""
 🎵 **Music Bot Status**
 🔗 Connected: {'✅' if status['connected'] else '❌'}
 📱 Chat ID: `{status['chat_id']}`
 🎵 Group Call: {'✅' if status['has_group_call'] else '❌'}
-                """
-                await event.respond(status_text)
-            except Exception as e:
-                await event.respond(f"❌ Error: {e}")
+▶️ Playing: {'✅' if status['playing'] else '❌'}
+⏸️ Paused: {'✅' if status['paused'] else '❌'}
+🔇 Muted: {'✅' if status['muted'] else '❌'}
+            """
+            await event.respond(status_text)
+        except Exception as e:
+            await event.respond(f"❌ Error: {e}")
 
     async def run_until_disconnected(self):
         """Run userbot until disconnected"""
@@ -384,33 +423,46 @@ class MusicUserbot:
             logger.info("🎵 Music userbot is now running...")
             await self.client.run_until_disconnected()
         except Exception as e:
-            logger.error(f"❌ Error while running: {e}")
+            logger.error("❌ Error while running: %s", e)
 
     async def disconnect(self):
         """Disconnect userbot"""
         try:
             if self.music:
-                # Leave all voice chats
-                for chat_id in list(self.music.group_calls.keys()):
-                    await self.music.leave_voice_chat(int(chat_id))
+                await self.music.shutdown()
+                await self.music.aclose()
+                self.music = None
             
             if self.client and self.client.is_connected():
                 await self.client.disconnect()
+            
+            # A disconnected client is never reused - initialize() builds a fresh one,
+            # so logging out and back in doesn't pick up a stale in-memory session
+            self.client = None
+            self.me = None
+            self.is_authenticated = False
+            self.pending_code_hash = None
+            
+            # Write pending settings
+            await self.database.flush()
                 
             logger.info("✅ Userbot disconnected")
             
         except Exception as e:
-            logger.error(f"❌ Error disconnecting: {e}")
+            logger.error("❌ Error disconnecting: %s", e)
 
     def get_status(self) -> dict:
         """Get userbot status"""
-        return {
-            "authenticated": self.is_authenticated,
-            "connected": self.client.is_connected() if self.client else False,
-            "version": self.version,
-            "user": {
-                "id": self.me.id if self.me else None,
-                "first_name": self.me.first_name if self.me else None,
-                "username": getattr(self.me, 'username', None) if self.me else None
+        # User info only changes on login/logout - rebuild it when self.me is replaced
+        if self._status_me is not self.me:
+            self._status_me = self.me
+            self._status['user'] = {
+                "id": self.me.id,
+                "first_name": self.me.first_name,
+                "username": getattr(self.me, 'username', None)
             } if self.me else None
-        }
\ No newline at end of file
+        
+        status = self._status.copy()
+        status['authenticated'] = self.is_authenticated
+        status['connected'] = self.client.is_connected() if self.client else False
+        return status
\ No newline at end of file
@@ -3,39 +3,99 @@
 Simple database for userbot settings
 """
 
-import json
+import asyncio
 import logging
+import os
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
 
 class Database:
+    CREDENTIAL_KEYS = ('api_id', 'api_hash')
+
+    # Delay before a pending change is written, so bursts of writes are batched
+    FLUSH_DELAY = 0.1
+
     def __init__(self):
         self.data_dir = Path(__file__).parent.parent / "data"
         self.data_dir.mkdir(exist_ok=True)
         self.db_file = self.data_dir / "settings.json"
         self._data = self._load()
+        self._creds = self._read_credentials()
+        
+        # Background flush state
+        self._dirty = False
+        self._flush_event = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
 
     def _load(self) -> Dict[str, Any]:
         """Load data from file"""
         try:
             if self.db_file.exists():
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return orjson.loads(self.db_file.read_bytes())
         except Exception as e:
-            logger.error(f"Error loading database: {e}")
+            logger.error("Error loading database: %s", e)
         
         return {}
 
-    def _save(self):
-        """Save data to file"""
+    def _save_sync(self, data: Dict[str, Any]):
+        """Save data to file (blocking)"""
+        # Write to a temp file and rename so a crash never leaves a torn file
+        tmp_file = self.db_file.with_name(self.db_file.name + '.tmp')
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self._data, f, indent=2, ensure_ascii=False)
+            tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, self.db_file)
         except Exception as e:
-            logger.error(f"Error saving database: {e}")
+            logger.error("Error saving database: %s", e)
+
+    def _save(self):
+        """Mark data dirty and schedule a background flush"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop - write immediately
+            self._dirty = False
+            self._save_sync(self._data)
+            return
+        
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_loop())
+        self._flush_event.set()
+
+    async def _flush_loop(self):
+        """Write pending changes once per batch - the only writer while running"""
+        while True:
+            await self._flush_event.wait()
+            if not self._stopping:
+                await asyncio.sleep(self.FLUSH_DELAY)
+            self._flush_event.clear()
+            if self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._save_sync, dict(self._data))
+            if self._stopping and not self._dirty:
+                return
+
+    async def flush(self):
+        """Write any pending changes and stop background flusher"""
+        if not self._dirty and (self._flusher is None or self._flusher.done()):
+            return
+        
+        # Drain the flusher instead of cancelling it - cancelling doesn't stop its
+        # worker thread, and a second write would race it on the same temp file
+        self._stopping = True
+        try:
+            if self._flusher is None or self._flusher.done():
+                self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+            self._flush_event.set()
+            await asyncio.shield(self._flusher)
+        finally:
+            self._stopping = False
 
     def get(self, key: str, default: Any = None) -> Any:
         """Get value by key"""
@@ -44,17 +104,22 @@ class Database:
     def set(self, key: str, value: Any):
         """Set value by key"""
         self._data[key] = value
+        if key in self.CREDENTIAL_KEYS:
+            self._creds = self._read_credentials()
         self._save()
 
     def delete(self, key: str):
         """Delete key"""
         if key in self._data:
             del self._data[key]
+            if key in self.CREDENTIAL_KEYS:
+                self._creds = None
             self._save()
 
     def clear(self):
         """Clear all data"""
         self._data = {}
+        self._creds = None
         self._save()
 
     # Async methods for compatibility
@@ -66,16 +131,22 @@ class Database:
         """Set setting value (async wrapper)"""
         self.set(key, value)
     
+    def _read_credentials(self) -> Optional[Dict[str, Any]]:
+        """Build credentials dict from loaded data"""
+        api_id = self._data.get('api_id')
+        api_hash = self._data.get('api_hash')
+        if api_id and api_hash:
+            return {'api_id': api_id, 'api_hash': api_hash}
+        return None
+    
     def save_credentials(self, api_id: int, api_hash: str):
         """Save API credentials"""
-        self.set('api_id', api_id)
-        self.set('api_hash', api_hash)
+        self._data['api_id'] = api_id
+        self._data['api_hash'] = api_hash
+        self._creds = self._read_credentials()
+        self._save()
         logger.info('API credentials saved')
     
     def get_credentials(self) -> Optional[Dict[str, Any]]:
-        """Get saved API credentials"""
-        api_id = self.get('api_id')
-        api_hash = self.get('api_hash')
-        if api_id and api_hash:
-            return {'api_id': api_id, 'api_hash': api_hash}
-        return None
\ No newline at end of file
+        """Get saved API credentials (cached)"""
+        return self._creds
\ No newline at end of file
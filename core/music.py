@@ -6,16 +6,23 @@ Working with pytgcalls 2.1.0 GroupCallFactory API
 
 import io
 import os
+import json
+import shutil
+import hashlib
 import re
+import time
 import logging
+import tempfile
 import asyncio
-from typing import Dict, List, Optional
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
 from pathlib import Path
 
-import ffmpeg
 from yt_dlp import YoutubeDL
 from ShazamAPI import Shazam
 
+logger = logging.getLogger(__name__)
+
 # Fallback imports for pytgcalls
 try:
     from pytgcalls import GroupCallFactory
@@ -27,10 +34,49 @@ except ImportError:
     GroupCallFactory = None
     GroupCallFile = None
 
-logger = logging.getLogger(__name__)
+
+class ChatSession:
+    """Voice chat state for a single chat"""
+    __slots__ = ("call", "raw_path", "stream_file", "paused", "muted", "started_at")
+
+    def __init__(self, call, raw_path: Optional[str] = None, paused: bool = False,
+                 muted: bool = False, started_at: Optional[float] = None):
+        self.call = call
+        self.raw_path = raw_path
+        # Private file being filled by stream_audio(), removed when playback moves on
+        self.stream_file: Optional[str] = None
+        self.paused = paused
+        self.muted = muted
+        self.started_at = time.monotonic() if started_at is None else started_at
 
 
 class MusicManager:
+    # Disk budget for downloaded and converted audio in downloads_dir
+    CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # Simultaneous yt-dlp downloads, kept low to avoid YouTube throttling
+    MAX_CONCURRENT_DOWNLOADS = 2
+    # Seconds of audio decoded for Shazam, enough for its fingerprint window
+    SHAZAM_SECONDS = 15
+    # Containers that may already hold playable PCM
+    PCM_CONTAINERS = (".wav", ".w64", ".aiff", ".caf")
+    # Start playback while ffmpeg is still converting (needs POSIX unlink/link semantics)
+    STREAM_PLAYBACK = os.name != "nt"
+    # PCM written before playback starts (1s of s16le/48k/stereo)
+    STREAM_START_BYTES = 48000 * 2 * 2
+    # StreamReader buffer for ffmpeg/ffprobe pipes
+    SUBPROCESS_PIPE_LIMIT = 1024 * 1024
+
+    # Playout controls: name -> (pytgcalls method, args, session updates, log message).
+    # <name>_audio(chat_id) coroutines are generated from this table below the class.
+    _CONTROL_OPS = {
+        "stop": ("stop_playout", (), {"raw_path": None, "paused": False}, "⏹️ Stopped playback in chat %s"),
+        "pause": ("pause_playout", (), {"paused": True}, "⏸️ Paused playback in chat %s"),
+        "resume": ("resume_playout", (), {"paused": False}, "▶️ Resumed playback in chat %s"),
+        "replay": ("restart_playout", (), {"paused": False}, "🔄 Replaying audio in chat %s"),
+        "mute": ("set_is_mute", (True,), {"muted": True}, "🔇 Muted in chat %s"),
+        "unmute": ("set_is_mute", (False,), {"muted": False}, "🔊 Unmuted in chat %s"),
+    }
+
     def __init__(self, client):
         self.client = client
         self.data_dir = Path("data")
@@ -39,287 +85,611 @@ class MusicManager:
         # Ensure directories exist
         self.data_dir.mkdir(exist_ok=True)
         self.downloads_dir.mkdir(exist_ok=True)
+        self._remove_orphans()
         
         # Group calls storage - exactly like VoiceMod
-        self.group_calls: Dict[int, any] = {}
+        self.group_calls: Dict[int, ChatSession] = {}
+        # Serializes state transitions per chat without blocking other chats
+        self._chat_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Background tasks finishing streamed conversions
+        self._stream_tasks: Set[asyncio.Task] = set()
+        # Stream files ffmpeg is still filling -> remove once their conversion is done
+        self._converting: Dict[str, bool] = {}
         
-        # YoutubeDL options - working configuration from VoiceMod
+        # YoutubeDL options - download best audio as-is, convert_audio
+        # transcodes it straight to PCM (no intermediate mp3 re-encode)
         self.ytdlopts = {
-            "format": "bestaudio",
-            "addmetadata": True,
-            "key": "FFmpegMetadata",
-            "writethumbnail": True,
-            "prefer_ffmpeg": True,
+            "format": "bestaudio/best",
             "geo_bypass": True,
             "nocheckcertificate": True,
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "320",
-                }
-            ],
-            "outtmpl": str(self.downloads_dir / "ytdl_out.mp3"),
+            "noplaylist": True,
+            "outtmpl": str(self.downloads_dir / "%(extractor)s-%(id)s.%(ext)s"),
             "quiet": True,
             "logtostderr": False,
+            # Back off quickly from throttled streams instead of crawling along
+            "concurrent_fragment_downloads": 4,
+            "throttledratelimit": 100 * 1024,
+            "retries": 2,
+            "fragment_retries": 2,
+            "socket_timeout": 15,
+            "source_address": "0.0.0.0",
         }
+        
+        # Long-lived downloaders - YoutubeDL isn't thread-safe, so each download
+        # borrows one from the pool; pool size also caps concurrent downloads
+        self._ydl_pool: asyncio.Queue = asyncio.Queue()
+        for _ in range(self.MAX_CONCURRENT_DOWNLOADS):
+            self._ydl_pool.put_nowait(YoutubeDL(self.ytdlopts))
+        # In-flight downloads by cache key, so concurrent requests for one source
+        # share a download instead of writing the same yt-dlp file twice
+        self._downloads: Dict[str, asyncio.Task] = {}
 
     def _get_call(self, chat_id: int):
         """Get or create group call for chat - VoiceMod implementation"""
+        # Keys are always ints so lookups and iteration need no casts
+        chat_id = int(chat_id)
         if not PYTGCALLS_AVAILABLE:
             raise Exception("Voice chat features not available - pytgcalls dependency not installed")
             
         if chat_id not in self.group_calls:
             try:
-                self.group_calls[chat_id] = GroupCallFactory(
+                call = GroupCallFactory(
                     self.client, 
                     GroupCallFactory.MTPROTO_CLIENT_TYPE.TELETHON
                 ).get_file_group_call()
-                logger.info(f"Created new group call for chat {chat_id}")
+                self.group_calls[chat_id] = ChatSession(call)
+                logger.info("Created new group call for chat %s", chat_id)
             except Exception as e:
-                logger.error(f"Failed to create group call for {chat_id}: {e}")
+                logger.error("Failed to create group call for %s: %s", chat_id, e)
                 raise
         return self.group_calls[chat_id]
 
     async def join_voice_chat(self, chat_id: int) -> bool:
         """Join voice chat - VoiceMod style"""
         try:
-            self._get_call(chat_id)
-            await self.group_calls[chat_id].start(chat_id)
-            logger.info(f"✅ Joined voice chat in {chat_id}")
+            async with self._chat_locks[chat_id]:
+                session = self._get_call(chat_id)
+                await session.call.start(chat_id)
+            logger.info("✅ Joined voice chat in %s", chat_id)
             return True
         except Exception as e:
-            logger.error(f"❌ Failed to join voice chat in {chat_id}: {e}")
+            logger.error("❌ Failed to join voice chat in %s: %s", chat_id, e)
             return False
 
     async def leave_voice_chat(self, chat_id: int) -> bool:
         """Leave voice chat - VoiceMod style"""
         try:
-            if chat_id in self.group_calls:
-                await self.group_calls[chat_id].stop()
+            # Check before touching _chat_locks so unknown chats don't leave a lock behind
+            if chat_id not in self.group_calls:
+                return False
+            async with self._chat_locks[chat_id]:
+                session = self.group_calls.get(chat_id)
+                if session is None:
+                    return False
+                await session.call.stop()
                 del self.group_calls[chat_id]
-                
-                # Clean up audio file
-                try:
-                    os.remove(f"{chat_id}.raw")
-                except FileNotFoundError:
-                    pass
-                
-                logger.info(f"✅ Left voice chat in {chat_id}")
-                return True
-            return False
+                self._release_stream(session.stream_file)
+            self._chat_locks.pop(chat_id, None)
+            
+            # Clean up audio file
+            try:
+                os.remove(f"{chat_id}.raw")
+            except FileNotFoundError:
+                pass
+            
+            logger.info("✅ Left voice chat in %s", chat_id)
+            return True
         except Exception as e:
-            logger.error(f"❌ Failed to leave voice chat in {chat_id}: {e}")
+            logger.error("❌ Failed to leave voice chat in %s: %s", chat_id, e)
+            return False
+
+    def _cache_path(self, source: str) -> Path:
+        """Path of cached PCM for source"""
+        key = hashlib.sha1(source.encode()).hexdigest()[:16]
+        return self.downloads_dir / f"{key}.raw"
+
+    def _remove_orphans(self):
+        """Remove work files left behind by a previous run"""
+        # No task owns these at startup, and _evict_cache never touches them
+        for file in self.downloads_dir.iterdir():
+            name = file.name
+            if name.startswith(("stream-", "shazam-")) or name.endswith((".tmp", ".link")):
+                self._remove(str(file))
+
+    @staticmethod
+    def _is_cache_entry(name: str) -> bool:
+        """Check if downloads_dir file is a finished cache entry rather than work in progress"""
+        # stream-*: still being converted or played, shazam-*: awaiting recognition,
+        # .part/.ytdl: yt-dlp downloads, .tmp/.link: conversion and publish temp files
+        if name.startswith(("stream-", "shazam-")):
             return False
+        return ".part" not in name and not name.endswith((".ytdl", ".tmp", ".link"))
+
+    def _evict_cache(self, in_use: set):
+        """Remove least recently used downloads until cache fits budget"""
+        files = []
+        seen = set()
+        total = 0
+        for file in self.downloads_dir.iterdir():
+            if not self._is_cache_entry(file.name):
+                continue
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if not file.is_file():
+                continue
+            # Hard-linked stream/cache pairs share their data - count it once
+            inode = (stat.st_dev, stat.st_ino)
+            if inode in seen:
+                continue
+            seen.add(inode)
+            files.append((stat.st_mtime, stat.st_size, file))
+            total += stat.st_size
+        
+        files.sort(key=lambda item: item[0])
+        for _, size, file in files:
+            if total <= self.CACHE_MAX_BYTES:
+                break
+            if str(file) in in_use:
+                continue
+            try:
+                file.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
 
     async def download_audio(self, source: str) -> Optional[str]:
         """Download audio from URL - VoiceMod implementation"""
+        key = str(self._cache_path(source))
+        task = self._downloads.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._download(source))
+            self._downloads[key] = task
+            task.add_done_callback(lambda _: self._downloads.pop(key, None))
+        
+        # Shielded so one cancelled caller doesn't abort the download for the others
+        return await asyncio.shield(task)
+
+    async def _download(self, source: str) -> Optional[str]:
+        """Download audio with a pooled YoutubeDL"""
         try:
-            # Clean up previous downloads
-            for file in self.downloads_dir.glob("ytdl_out.*"):
-                if file.is_file():
-                    file.unlink()
-            
-            with YoutubeDL(self.ytdlopts) as ydl:
-                ydl.extract_info(source)
+            ydl = await self._ydl_pool.get()
+            extract = asyncio.ensure_future(asyncio.to_thread(self._download_sync, ydl, source))
+            # Return ydl only once its thread is done, even if we're cancelled meanwhile
+            extract.add_done_callback(lambda _: self._ydl_pool.put_nowait(ydl))
+            audio_file = await asyncio.shield(extract)
             
             # Return the downloaded file path
-            audio_file = self.downloads_dir / "ytdl_out.mp3"
-            if audio_file.exists():
+            if audio_file and audio_file.exists():
                 return str(audio_file)
             
             return None
         except Exception as e:
-            logger.error(f"❌ Failed to download audio: {e}")
+            logger.error("❌ Failed to download audio: %s", e)
+            return None
+
+    @staticmethod
+    def _download_sync(ydl, source: str) -> Optional[Path]:
+        """Download source and return its file path (blocking)"""
+        info = ydl.extract_info(source, download=True)
+        if info and info.get("entries"):
+            info = info["entries"][0]
+        if not info:
+            return None
+        return Path(ydl.prepare_filename(info))
+
+    async def _probe_audio(self, input_file: str) -> Optional[dict]:
+        """Get codec, sample rate and channels of first audio stream via ffprobe"""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffprobe", "-hide_banner", "-v", "error",
+                "-select_streams", "a:0",
+                "-show_entries", "stream=codec_name,sample_rate,channels",
+                "-of", "json",
+                input_file,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                limit=self.SUBPROCESS_PIPE_LIMIT
+            )
+            stdout, _ = await proc.communicate()
+            if proc.returncode != 0:
+                return None
+            streams = json.loads(stdout).get("streams")
+            return streams[0] if streams else None
+        except Exception as e:
+            logger.error("❌ Failed to probe audio: %s", e)
             return None
 
-    async def convert_audio(self, input_file: str, chat_id: int) -> str:
+    async def _is_target_pcm(self, input_file: str) -> bool:
+        """Check if input already holds s16le/48k/stereo samples"""
+        # Only PCM containers can match, so skip the ffprobe run for everything else
+        if Path(input_file).suffix.lower() not in self.PCM_CONTAINERS:
+            return False
+        stream = await self._probe_audio(input_file)
+        return bool(stream) and (
+            stream.get("codec_name") == "pcm_s16le"
+            and str(stream.get("sample_rate")) == "48000"
+            and stream.get("channels") == 2
+        )
+
+    async def _spawn_ffmpeg(self, input_file: str, output_file: str):
+        """Start ffmpeg writing s16le/48k/stereo PCM - VoiceMod configuration"""
+        if await self._is_target_pcm(input_file):
+            # Samples already match - just strip the container, no decode/resample
+            codec_args = ["-c:a", "copy"]
+        else:
+            codec_args = ["-acodec", "pcm_s16le", "-ac", "2", "-ar", "48000"]
+        
+        # Quiet output: no banner or per-frame stats, only errors reach the pipe
+        return await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y",
+            "-hide_banner", "-nostats", "-loglevel", "error",
+            "-i", input_file,
+            "-f", "s16le",
+            *codec_args,
+            output_file,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            limit=self.SUBPROCESS_PIPE_LIMIT
+        )
+
+    @staticmethod
+    def _ffmpeg_error(proc, stderr: bytes) -> RuntimeError:
+        """Build error from failed ffmpeg run"""
+        return RuntimeError(
+            f"ffmpeg exited with code {proc.returncode}: "
+            f"{stderr.decode(errors='replace').strip()[-500:]}"
+        )
+
+    @staticmethod
+    def _remove(path: Optional[str]):
+        """Remove file if it exists"""
+        if not path:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def convert_audio(self, input_file: str, output_file: str) -> str:
         """Convert audio to required format - exact VoiceMod implementation"""
-        output_file = f"{chat_id}.raw"
+        # Write to a unique temp name so an interrupted conversion never looks
+        # complete and concurrent conversions to the same output don't collide
+        fd, tmp_file = tempfile.mkstemp(
+            prefix=f"{Path(output_file).name}.", suffix=".tmp", dir=Path(output_file).parent
+        )
+        os.close(fd)
         
         try:
-            # Remove existing output file
-            if os.path.exists(output_file):
-                os.remove(output_file)
+            proc = await self._spawn_ffmpeg(input_file, tmp_file)
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise self._ffmpeg_error(proc, stderr)
             
-            # Convert using ffmpeg - VoiceMod configuration
-            ffmpeg.input(input_file).output(
-                output_file, 
-                format="s16le", 
-                acodec="pcm_s16le", 
-                ac=2, 
-                ar="48k"
-            ).overwrite_output().run()
-            
-            # Clean up input file
-            os.remove(input_file)
-                
+            os.replace(tmp_file, output_file)
             return output_file
             
         except Exception as e:
-            logger.error(f"❌ Failed to convert audio: {e}")
+            logger.error("❌ Failed to convert audio: %s", e)
+            self._remove(tmp_file)
+            raise
+
+    async def stream_audio(self, input_file: str, output_file: Optional[str] = None,
+                           remove_input: bool = False) -> str:
+        """Start converting audio and return a playable file once the first samples exist
+        
+        ffmpeg keeps filling the returned file at full speed, far ahead of real-time
+        playback. When it finishes, output_file (if given) is published as a hard link
+        to the same data and input_file is removed if remove_input is set.
+        """
+        fd, stream_file = tempfile.mkstemp(prefix="stream-", suffix=".raw", dir=self.downloads_dir)
+        os.close(fd)
+        
+        proc = communicate = None
+        try:
+            proc = await self._spawn_ffmpeg(input_file, stream_file)
+            communicate = asyncio.ensure_future(proc.communicate())
+            while not communicate.done() and os.path.getsize(stream_file) < self.STREAM_START_BYTES:
+                await asyncio.wait({communicate}, timeout=0.05)
+            
+            if communicate.done() and proc.returncode != 0:
+                _, stderr = communicate.result()
+                raise self._ffmpeg_error(proc, stderr)
+        except BaseException as e:
+            # Also on cancellation - otherwise ffmpeg keeps filling a file nobody owns
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+            if communicate is not None:
+                communicate.cancel()
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error("❌ Failed to convert audio: %s", e)
+            self._remove(stream_file)
+            if remove_input:
+                self._remove(input_file)
             raise
+        
+        self._converting[stream_file] = False
+        task = asyncio.ensure_future(self._finish_stream(
+            communicate, proc, stream_file, output_file, input_file if remove_input else None
+        ))
+        self._stream_tasks.add(task)
+        task.add_done_callback(self._stream_tasks.discard)
+        return stream_file
 
-    async def play_audio(self, chat_id: int, source: str) -> bool:
+    async def _finish_stream(self, communicate, proc, stream_file: str,
+                             output_file: Optional[str], input_file: Optional[str]):
+        """Wait for streamed conversion and publish its result"""
+        try:
+            _, stderr = await communicate
+            if proc.returncode != 0:
+                logger.error("❌ Failed to convert audio: %s", self._ffmpeg_error(proc, stderr))
+                return
+            
+            if output_file:
+                # Link (or copy) under a temp name, then rename into place atomically
+                link_file = f"{stream_file}.link"
+                try:
+                    os.link(stream_file, link_file)
+                except OSError:
+                    shutil.copyfile(stream_file, link_file)
+                os.replace(link_file, output_file)
+        except Exception as e:
+            logger.error("❌ Failed to finish audio conversion: %s", e)
+        finally:
+            self._remove(input_file)
+            if self._converting.pop(stream_file, False):
+                self._remove(stream_file)
+
+    def _release_stream(self, stream_file: Optional[str]):
+        """Remove stream file, leaving it to _finish_stream while ffmpeg still writes it"""
+        if stream_file in self._converting:
+            # Removing it now would break publishing the finished conversion to the cache
+            self._converting[stream_file] = True
+        else:
+            self._remove(stream_file)
+
+    async def play_audio(self, chat_id: int, source: str, session: Optional[ChatSession] = None) -> bool:
         """Play audio in voice chat - VoiceMod implementation"""
         try:
             # Check if we're in voice chat
-            if chat_id not in self.group_calls:
-                logger.error(f"❌ Not joined to voice chat in {chat_id}")
-                return False
-            
-            # Download audio
-            logger.info(f"🎵 Downloading audio from: {source}")
-            audio_file = await self.download_audio(source)
-            if not audio_file:
-                logger.error("❌ Failed to download audio")
+            if session is None:
+                session = self.group_calls.get(chat_id)
+            if session is None:
+                logger.error("❌ Not joined to voice chat in %s", chat_id)
                 return False
             
-            # Convert audio to raw format
-            logger.info(f"🔄 Converting audio for voice chat")
-            raw_file = await self.convert_audio(audio_file, chat_id)
+            raw_file = self._cache_path(source)
+            play_file = str(raw_file)
+            stream_file = None
+            if raw_file.exists():
+                # Cache hit - skip download and conversion, refresh LRU position
+                logger.info("💾 Using cached audio for: %s", source)
+                os.utime(raw_file)
+            else:
+                # Download audio
+                logger.info("🎵 Downloading audio from: %s", source)
+                audio_file = await self.download_audio(source)
+                if not audio_file:
+                    logger.error("❌ Failed to download audio")
+                    return False
+                
+                # Convert audio to raw format, starting playback early when possible
+                logger.info("🔄 Converting audio for voice chat")
+                if self.STREAM_PLAYBACK:
+                    play_file = stream_file = await self.stream_audio(audio_file, str(raw_file))
+                else:
+                    await self.convert_audio(audio_file, play_file)
+                
+                # Never evict audio that a chat is currently playing
+                in_use = {str(raw_file), play_file}
+                in_use.update(s.raw_path for s in self.group_calls.values() if s.raw_path)
+                await asyncio.to_thread(self._evict_cache, in_use)
             
             # Play using VoiceMod method
-            logger.info(f"▶️ Starting playback in chat {chat_id}")
-            self.group_calls[chat_id].input_filename = raw_file
-            
-            return True
+            return await self._start_playout(chat_id, session, play_file, stream_file)
             
         except Exception as e:
-            logger.error(f"❌ Failed to play audio: {e}")
+            logger.error("❌ Failed to play audio: %s", e)
             return False
 
-    async def play_from_file(self, chat_id: int, file_path: str) -> bool:
+    async def play_from_file(self, chat_id: int, file_path: str, session: Optional[ChatSession] = None) -> bool:
         """Play audio from local file - VoiceMod implementation"""
         try:
             # Check if we're in voice chat
-            if chat_id not in self.group_calls:
-                logger.error(f"❌ Not joined to voice chat in {chat_id}")
+            if session is None:
+                session = self.group_calls.get(chat_id)
+            if session is None:
+                logger.error("❌ Not joined to voice chat in %s", chat_id)
                 return False
                 
-            # Convert audio to raw format
-            logger.info(f"🔄 Converting audio file for voice chat")
-            raw_file = await self.convert_audio(file_path, chat_id)
+            # Convert audio to raw format, starting playback early when possible
+            logger.info("🔄 Converting audio file for voice chat")
+            stream_file = None
+            if self.STREAM_PLAYBACK:
+                play_file = stream_file = await self.stream_audio(file_path, remove_input=True)
+            else:
+                try:
+                    play_file = await self.convert_audio(file_path, f"{chat_id}.raw")
+                finally:
+                    os.remove(file_path)
             
             # Play using VoiceMod method
-            logger.info(f"▶️ Starting playback in chat {chat_id}")
-            self.group_calls[chat_id].input_filename = raw_file
-            
-            return True
+            return await self._start_playout(chat_id, session, play_file, stream_file)
             
         except Exception as e:
-            logger.error(f"❌ Failed to play audio from file: {e}")
-            return False
-
-    async def stop_audio(self, chat_id: int) -> bool:
-        """Stop audio playback - VoiceMod implementation"""
-        try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].stop_playout()
-                logger.info(f"⏹️ Stopped playback in chat {chat_id}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Failed to stop audio: {e}")
-            return False
-
-    async def pause_audio(self, chat_id: int) -> bool:
-        """Pause audio playback - VoiceMod implementation"""
-        try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].pause_playout()
-                logger.info(f"⏸️ Paused playback in chat {chat_id}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Failed to pause audio: {e}")
-            return False
-
-    async def resume_audio(self, chat_id: int) -> bool:
-        """Resume audio playback - VoiceMod implementation"""
-        try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].resume_playout()
-                logger.info(f"▶️ Resumed playback in chat {chat_id}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Failed to resume audio: {e}")
+            logger.error("❌ Failed to play audio from file: %s", e)
             return False
 
-    async def replay_audio(self, chat_id: int) -> bool:
-        """Replay current audio - VoiceMod implementation"""
-        try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].restart_playout()
-                logger.info(f"🔄 Replaying audio in chat {chat_id}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Failed to replay audio: {e}")
-            return False
-
-    async def mute_audio(self, chat_id: int) -> bool:
-        """Mute audio - VoiceMod implementation"""
-        try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].set_is_mute(True)
-                logger.info(f"🔇 Muted in chat {chat_id}")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"❌ Failed to mute audio: {e}")
-            return False
+    async def _start_playout(self, chat_id: int, session: ChatSession, raw_path: str,
+                             stream_file: Optional[str] = None) -> bool:
+        """Point group call at raw file and reset pause flag"""
+        async with self._chat_locks[chat_id]:
+            # Chat may have been left while the audio was being prepared
+            if self.group_calls.get(chat_id) is not session:
+                logger.error("❌ Voice chat in %s was left before playback started", chat_id)
+                self._release_stream(stream_file)
+                return False
+            
+            logger.info("▶️ Starting playback in chat %s", chat_id)
+            session.call.input_filename = raw_path
+            session.raw_path = raw_path
+            session.paused = False
+            
+            # Previous streamed file is no longer read by the call
+            if session.stream_file != stream_file:
+                self._release_stream(session.stream_file)
+            session.stream_file = stream_file
+            return True
 
-    async def unmute_audio(self, chat_id: int) -> bool:
-        """Unmute audio - VoiceMod implementation"""
+    async def _control(self, chat_id: int, name: str) -> bool:
+        """Apply playout control from _CONTROL_OPS - VoiceMod implementation"""
+        method, args, updates, message = self._CONTROL_OPS[name]
         try:
-            if chat_id in self.group_calls:
-                self.group_calls[chat_id].set_is_mute(False)
-                logger.info(f"🔊 Unmuted in chat {chat_id}")
-                return True
-            return False
+            if chat_id not in self.group_calls:
+                return False
+            async with self._chat_locks[chat_id]:
+                session = self.group_calls.get(chat_id)
+                if session is None:
+                    return False
+                getattr(session.call, method)(*args)
+                for attr, value in updates.items():
+                    setattr(session, attr, value)
+            logger.info(message, chat_id)
+            return True
         except Exception as e:
-            logger.error(f"❌ Failed to unmute audio: {e}")
+            logger.error("❌ Failed to %s audio: %s", name, e)
             return False
 
     async def shazam_recognize(self, audio_bytes: bytes) -> Optional[dict]:
-        """Recognize track using Shazam - Fixed implementation"""
+        """Recognize track using Shazam without blocking the event loop"""
+        return await asyncio.to_thread(self._shazam_sync, audio_bytes)
+
+    def _shazam_sync(self, audio_bytes: bytes) -> Optional[dict]:
+        """Recognize track using Shazam - Fixed implementation (blocking)"""
         try:
+            # A fresh Shazam per call is intentional: ShazamAPI 0.0.2's constructor only
+            # stores the payload (decoding and HTTP happen in recognizeSong), so a shared
+            # instance would save nothing and would race between concurrent to_thread calls.
             shazam = Shazam(audio_bytes)
             recog = shazam.recognizeSong()
             
-            # Get the first result from generator
-            result = list(recog)
-            if result:
-                track = result[0][1]["track"]
-                
-                response = {
-                    "title": track.get("title", "Unknown"),
-                    "artist": track.get("subtitle", "Unknown"), 
-                    "image": track.get("images", {}).get("background", ""),
-                    "share": track.get("share", {}).get("subject", "")
-                }
-                
-                logger.info(f"🎵 Recognized track: {response['title']} - {response['artist']}")
-                return response
+            # Stop at the first chunk that matched a track
+            for _, data in recog:
+                track = data.get("track")
+                if track:
+                    break
+            else:
+                return None
+            
+            response = {
+                "title": track.get("title", "Unknown"),
+                "artist": track.get("subtitle", "Unknown"), 
+                "image": track.get("images", {}).get("background", ""),
+                "share": track.get("share", {}).get("subject", "")
+            }
+            
+            logger.info("🎵 Recognized track: %s - %s", response['title'], response['artist'])
+            return response
             
+        except Exception as e:
+            logger.error("❌ Failed to recognize track: %s", e)
             return None
+
+    async def _shazam_clip(self, file_path: str) -> bytes:
+        """Decode the first SHAZAM_SECONDS of audio to a small mono WAV"""
+        # Cut by time, not bytes - a byte prefix of m4a with a trailing moov atom
+        # can't be decoded, and for lossless formats it's only a few seconds
+        fd, clip_file = tempfile.mkstemp(prefix="shazam-", suffix=".tmp", dir=self.downloads_dir)
+        os.close(fd)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y",
+                "-hide_banner", "-nostats", "-loglevel", "error",
+                "-t", str(self.SHAZAM_SECONDS),
+                "-i", file_path,
+                "-ac", "1", "-ar", "16000",
+                "-f", "wav",
+                clip_file,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                limit=self.SUBPROCESS_PIPE_LIMIT
+            )
+            _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise self._ffmpeg_error(proc, stderr)
             
+            with open(clip_file, 'rb') as f:
+                return f.read()
+        finally:
+            self._remove(clip_file)
+
+    async def shazam_recognize_file(self, file_path: str) -> Optional[dict]:
+        """Recognize track from audio file, removing the file afterwards"""
+        try:
+            try:
+                audio_bytes = await self._shazam_clip(file_path)
+            except Exception as e:
+                # Let Shazam decode the whole file instead
+                logger.warning("Failed to cut audio for Shazam, using whole file: %s", e)
+                with open(file_path, 'rb') as f:
+                    audio_bytes = f.read()
         except Exception as e:
-            logger.error(f"❌ Failed to recognize track: {e}")
+            logger.error("❌ Failed to read audio file: %s", e)
             return None
+        finally:
+            self._remove(file_path)
+        
+        return await self.shazam_recognize(audio_bytes)
 
     def get_status(self, chat_id: int) -> dict:
         """Get playback status"""
-        is_connected = chat_id in self.group_calls
+        session = self.group_calls.get(chat_id)
+        is_connected = session is not None
         
         return {
             "connected": is_connected,
             "chat_id": chat_id,
-            "has_group_call": is_connected
+            "has_group_call": is_connected,
+            "playing": is_connected and session.raw_path is not None and not session.paused,
+            "paused": is_connected and session.paused,
+            "muted": is_connected and session.muted,
+            "uptime": round(time.monotonic() - session.started_at) if is_connected else None
         }
 
+    async def shutdown(self):
+        """Leave all voice chats in parallel"""
+        await asyncio.gather(
+            *(self.leave_voice_chat(chat_id) for chat_id in list(self.group_calls)),
+            return_exceptions=True
+        )
+
+    async def aclose(self):
+        """Release downloader resources"""
+        # Let background conversions finish so their results land in the cache
+        if self._stream_tasks:
+            await asyncio.gather(*self._stream_tasks, return_exceptions=True)
+        
+        # Take back every downloader, waiting for ones still lent to a download thread
+        for _ in range(self.MAX_CONCURRENT_DOWNLOADS):
+            ydl = await self._ydl_pool.get()
+            ydl.close()
+
     def debug_info(self) -> str:
         """Debug information - VoiceMod style"""
-        return f"DEBUG: Group calls: {list(self.group_calls.keys())}"
\ No newline at end of file
+        return f"DEBUG: Group calls: {list(self.group_calls.keys())}"
+
+
+def _make_control(name: str):
+    """Build <name>_audio coroutine method dispatching to MusicManager._control"""
+    async def control(self, chat_id: int) -> bool:
+        return await self._control(chat_id, name)
+    control.__name__ = f"{name}_audio"
+    control.__qualname__ = f"MusicManager.{name}_audio"
+    control.__doc__ = f"{name.capitalize()} audio playback"
+    return control
+
+
+for _name in MusicManager._CONTROL_OPS:
+    setattr(MusicManager, f"{_name}_audio", _make_control(_name))
+del _name
@@ -18,6 +18,12 @@ sys.path.insert(0, str(project_root))
 from core.client import MusicUserbot
 from web.server import WebServer
 
+# Faster event loop when available (not supported on Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -56,7 +62,7 @@ async def main():
         if not args.no_web and web_server:
             # Start web server in background
             web_task = asyncio.create_task(web_server.run_forever())
-            logger.info(f"🌐 Web interface available at http://0.0.0.0:{args.port}")
+            logger.info("🌐 Web interface available at http://0.0.0.0:%s", args.port)
         
         # Try to auto-initialize and start userbot if credentials and session exist
         if userbot.has_saved_credentials() and userbot.session_file.exists():
@@ -72,7 +78,7 @@ async def main():
                 else:
                     logger.info("⏳ Authentication required. Use web interface to login.")
             except Exception as e:
-                logger.info(f"⏳ Auto-start failed: {e}. Use web interface to setup.")
+                logger.info("⏳ Auto-start failed: %s. Use web interface to setup.", e)
         elif userbot.client:
             try:
                 success = await userbot.start(force_auth=args.auth)
@@ -97,7 +103,7 @@ async def main():
     except KeyboardInterrupt:
         logger.info("🛑 Stopping userbot...")
     except Exception as e:
-        logger.error(f"❌ Fatal error: {e}")
+        logger.error("❌ Fatal error: %s", e)
     finally:
         if userbot and userbot.client:
             await userbot.disconnect()
@@ -106,4 +112,12 @@ async def main():
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop and sys.version_info >= (3, 11):
+        logger.info("⚡ Using uvloop event loop")
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        if uvloop:
+            uvloop.install()
+            logger.info("⚡ Using uvloop event loop")
+        asyncio.run(main())
\ No newline at end of file
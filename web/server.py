@@ -4,7 +4,8 @@ Web Interface for Telegram Music Userbot
 """
 
 import asyncio
-import json
+import gzip
+import hmac
 import logging
 import os
 import secrets
@@ -15,11 +16,22 @@ from typing import Optional
 from aiohttp import web, WSMsgType
 from aiohttp_jinja2 import setup as jinja_setup, template
 import jinja2
-import aiofiles
+import orjson
 
 logger = logging.getLogger(__name__)
 
 
+def json_response(data, status: int = 200) -> web.Response:
+    """JSON response serialized with orjson"""
+    return web.Response(body=orjson.dumps(data), status=status, content_type='application/json')
+
+
+AUTH_REQUIRED_BODY = orjson.dumps({
+    'success': False,
+    'error': 'Authentication required. Provide secret in Authorization header.'
+})
+
+
 class WebServer:
     def __init__(self, userbot, port: int = 5000):
         self.userbot = userbot
@@ -27,12 +39,21 @@ class WebServer:
         self.app = None
         self.runner = None
         self.site = None
+        self._shutdown = asyncio.Event()
         
         # Security
         self.auth_secret = os.environ.get('AUTH_SECRET') or self._generate_auth_secret()
+        self._expected_auth = f"Bearer {self.auth_secret}".encode()
         logger.info("🔐 Web authentication enabled")
         logger.info("🔑 AUTH_SECRET для доступа сгенерирован")
         
+        # Health check body never changes, serialize it once
+        self._health_body = orjson.dumps({
+            'status': 'healthy',
+            'version': self.userbot.version,
+            'port': self.port
+        })
+        
         # Paths
         self.templates_dir = Path(__file__).parent.parent / "templates"
         self.static_dir = Path(__file__).parent.parent / "static"
@@ -51,6 +72,7 @@ class WebServer:
         self.app.middlewares.append(self._security_headers_middleware)
         
         # Setup routes
+        await asyncio.to_thread(self._precompress_static)
         self._setup_routes()
         
         # Start server
@@ -60,7 +82,7 @@ class WebServer:
         self.site = web.TCPSite(self.runner, '0.0.0.0', self.port)
         await self.site.start()
         
-        logger.info(f"🌐 Web server started on http://0.0.0.0:{self.port}")
+        logger.info("🌐 Web server started on http://0.0.0.0:%s", self.port)
         logger.info("🔑 Для доступа используйте Bearer токен (проверьте переменную AUTH_SECRET)")
         logger.info("📋 Добавьте заголовок: Authorization: Bearer <токен>")
 
@@ -68,10 +90,9 @@ class WebServer:
         """Start server and keep it running"""
         await self.start()
         
-        # Keep running forever until cancelled
+        # Keep running until stopped or cancelled
         try:
-            while True:
-                await asyncio.sleep(3600)  # Sleep for 1 hour at a time
+            await self._shutdown.wait()
         except asyncio.CancelledError:
             logger.info("Web server shutting down...")
             raise
@@ -86,11 +107,34 @@ class WebServer:
         print(f"🔐 AUTH_SECRET for web access: {secret}")  # Print to console only
         return secret
     
+    def _precompress_static(self):
+        """Write .gz copies of text assets so aiohttp can send them without compressing per request"""
+        for file in self.static_dir.iterdir():
+            if file.suffix not in ('.css', '.js', '.html', '.svg'):
+                continue
+            gz_file = file.with_name(file.name + '.gz')
+            try:
+                if gz_file.exists() and gz_file.stat().st_mtime >= file.stat().st_mtime:
+                    continue
+                gz_file.write_bytes(gzip.compress(file.read_bytes(), compresslevel=9))
+            except OSError as e:
+                logger.warning("Could not precompress %s: %s", file.name, e)
+
     @web.middleware
     async def _security_headers_middleware(self, request, handler):
-        """Add security headers to all responses"""
+        """Check API auth and add security headers to all responses"""
+        # Health probes are frequent and carry no sensitive data
+        if request.path == '/healthz':
+            return await handler(request)
+        
         try:
-            response = await handler(request)
+            # API routes are protected - reject before reaching the handler
+            if request.path.startswith('/api/') and not self._check_auth(request):
+                response = web.Response(
+                    body=AUTH_REQUIRED_BODY, status=401, content_type='application/json'
+                )
+            else:
+                response = await handler(request)
         except web.HTTPException as ex:
             response = ex
         
@@ -110,24 +154,15 @@ class WebServer:
         """Check if request is authenticated"""
         # Only check Authorization header - no query parameters
         auth_header = request.headers.get('Authorization')
-        if auth_header == f"Bearer {self.auth_secret}":
-            return True
-            
-        return False
+        if auth_header is None:
+            return False
+        # Constant-time compare to avoid leaking the secret via timing. aiohttp decodes
+        # headers with surrogateescape, so undo that instead of failing on non-UTF-8 bytes
+        return hmac.compare_digest(auth_header.encode('utf-8', 'surrogateescape'), self._expected_auth)
     
-    def _require_auth(self, handler):
-        """Decorator to require authentication"""
-        async def wrapper(request):
-            if not self._check_auth(request):
-                return web.json_response({
-                    'success': False,
-                    'error': 'Authentication required. Provide secret in Authorization header.'
-                }, status=401)
-            return await handler(request)
-        return wrapper
-
     async def stop(self):
         """Stop web server"""
+        self._shutdown.set()
         if self.site:
             await self.site.stop()
         if self.runner:
@@ -136,21 +171,28 @@ class WebServer:
     def _setup_routes(self):
         """Setup web routes"""
         
-        # Static files
-        self.app.router.add_static('/static/', path=self.static_dir, name='static')
+        # Static files - served via sendfile, precompressed .gz siblings used when accepted
+        self.app.router.add_static(
+            '/static/',
+            path=self.static_dir,
+            name='static',
+            append_version=True,
+            show_index=False,
+            follow_symlinks=False
+        )
         
         # Main routes
         self.app.router.add_get('/', self.index)
         self.app.router.add_get('/app', self.app_page)
         self.app.router.add_get('/healthz', self.healthcheck)
-        self.app.router.add_get('/api/user_status', self._require_auth(self.api_get_user_status))
+        self.app.router.add_get('/api/user_status', self.api_get_user_status)
         
         # API routes (protected)
-        self.app.router.add_post('/api/init', self._require_auth(self.api_init))
-        self.app.router.add_post('/api/send_code', self._require_auth(self.api_send_code))
-        self.app.router.add_post('/api/verify_code', self._require_auth(self.api_verify_code))
-        self.app.router.add_get('/api/status', self._require_auth(self.api_status))
-        self.app.router.add_post('/api/logout', self._require_auth(self.api_logout))
+        self.app.router.add_post('/api/init', self.api_init)
+        self.app.router.add_post('/api/send_code', self.api_send_code)
+        self.app.router.add_post('/api/verify_code', self.api_verify_code)
+        self.app.router.add_get('/api/status', self.api_status)
+        self.app.router.add_post('/api/logout', self.api_logout)
 
     @template('login.html')
     async def index(self, request):
@@ -171,11 +213,7 @@ class WebServer:
 
     async def healthcheck(self, request):
         """Health check endpoint - no auth required"""
-        return web.json_response({
-            'status': 'healthy',
-            'version': self.userbot.version,
-            'port': self.port
-        })
+        return web.Response(body=self._health_body, content_type='application/json')
 
     async def api_get_user_status(self, request):
         """Get user status via API"""
@@ -189,7 +227,7 @@ class WebServer:
                 'phone': getattr(self.userbot.me, 'phone', None)
             }
         
-        return web.json_response({
+        return json_response({
             'success': True,
             'authenticated': self.userbot.is_authenticated,
             'user': user_info,
@@ -199,31 +237,31 @@ class WebServer:
     async def api_init(self, request):
         """Initialize userbot with API credentials"""
         try:
-            data = await request.json()
+            data = orjson.loads(await request.read())
             api_id = data.get('api_id')
             api_hash = data.get('api_hash')
             
             if not api_id or not api_hash:
-                return web.json_response({
+                return json_response({
                     'success': False,
                     'error': 'API ID and API Hash are required'
                 })
             
             await self.userbot.initialize(int(api_id), api_hash)
             
-            return web.json_response({
+            return json_response({
                 'success': True,
                 'message': 'Userbot initialized successfully'
             })
             
         except ValueError as e:
-            return web.json_response({
+            return json_response({
                 'success': False,
                 'error': 'API ID must be a valid number'
             })
         except Exception as e:
-            logger.error(f"Init error: {e}")
-            return web.json_response({
+            logger.error("Init error: %s", e)
+            return json_response({
                 'success': False,
                 'error': str(e)
             })
@@ -231,25 +269,21 @@ class WebServer:
     async def api_send_code(self, request):
         """Send verification code to phone"""
         try:
-            data = await request.json()
+            data = orjson.loads(await request.read())
             phone = data.get('phone', '').strip()
             
             if not phone:
-                return web.json_response({
+                return json_response({
                     'success': False,
                     'error': 'Phone number is required'
                 })
             
-            # Ensure client is connected
-            if self.userbot.client and not self.userbot.client.is_connected():
-                await self.userbot.client.connect()
-            
             result = await self.userbot.send_code(phone)
-            return web.json_response(result)
+            return json_response(result)
             
         except Exception as e:
-            logger.error(f"Send code error: {e}")
-            return web.json_response({
+            logger.error("Send code error: %s", e)
+            return json_response({
                 'success': False,
                 'error': str(e)
             })
@@ -257,26 +291,22 @@ class WebServer:
     async def api_verify_code(self, request):
         """Verify phone code and optionally 2FA password"""
         try:
-            data = await request.json()
+            data = orjson.loads(await request.read())
             code = data.get('code', '').strip()
             password = data.get('password', '').strip() or None
             
             if not code:
-                return web.json_response({
+                return json_response({
                     'success': False,
                     'error': 'Verification code is required'
                 })
             
-            # Ensure client is connected
-            if self.userbot.client and not self.userbot.client.is_connected():
-                await self.userbot.client.connect()
-            
             result = await self.userbot.verify_code(code, password)
-            return web.json_response(result)
+            return json_response(result)
             
         except Exception as e:
-            logger.error(f"Verify code error: {e}")
-            return web.json_response({
+            logger.error("Verify code error: %s", e)
+            return json_response({
                 'success': False,
                 'error': str(e)
             })
@@ -284,13 +314,13 @@ class WebServer:
     async def api_status(self, request):
         """Get userbot status"""
         try:
-            return web.json_response({
+            return json_response({
                 'success': True,
                 'status': self.userbot.get_status()
             })
         except Exception as e:
-            logger.error(f"Status error: {e}")
-            return web.json_response({
+            logger.error("Status error: %s", e)
+            return json_response({
                 'success': False,
                 'error': str(e)
             })
@@ -307,14 +337,14 @@ class WebServer:
             self.userbot.is_authenticated = False
             self.userbot.me = None
             
-            return web.json_response({
+            return json_response({
                 'success': True,
                 'message': 'Logged out successfully'
             })
             
         except Exception as e:
-            logger.error(f"Logout error: {e}")
-            return web.json_response({
+            logger.error("Logout error: %s", e)
+            return json_response({
                 'success': False,
                 'error': str(e)
             })
\ No newline at end of file